@@ -4,30 +4,38 @@ Wejście: CSV z kolumnami (dokładnie): TEKST, TŁUMACZENIE, LINK DO OBRAZKA
 Wyjście: PDF w orientacji pionowej (A4) z kartami 3x3 (9 kart na stronę).
 
 Wymagania:
-pip install reportlab pillow requests
+pip install reportlab pillow requests aiohttp
 
 Użycie:
 python fiszki_pdf_generator.py input.csv output.pdf
 
 Obsługa:
-- Jeśli LINK DO OBRAZKA to URL -> pobiera obraz przez HTTP
+- Jeśli LINK DO OBRAZKA to URL -> pobiera obraz przez HTTP (równolegle, przed rysowaniem PDF)
 - Jeśli to ścieżka lokalna -> otwiera plik
 - Jeśli nie ma obrazu lub wystąpi błąd -> rysuje placeholder
 - CSV czytane jako UTF-8 (zalecane utf-8-sig)
 
 """
 
+import asyncio
 import csv
+import hashlib
 import sys
+import tempfile
 import os
 import io
+import functools
 import math
-import requests
-from PIL import Image, ImageOps
+from urllib.parse import urlsplit, urlunsplit
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.units import mm
+from reportlab.lib.colors import gray
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
@@ -46,45 +54,127 @@ GAP = GAP_MM * mm
 # Font sizes
 WORD_FONT_SIZE = 20
 TRANSL_FONT_SIZE = 20
+SENTENCE_FONT_SIZE = 10
+
+# Padding inside card
+CARD_PADDING = 6 * mm
 
 # Image area ratio inside card (fraction of card height reserved for image)
 IMAGE_HEIGHT_RATIO = 0.52
 IMAGE_MAX_WIDTH_RATIO = 0.9
 
+# Resolution of embedded images (px per inch of the printed card);
+# 72 = 1 px per point, never more pixels than the image box in points
+IMAGE_DPI = 72
+JPEG_QUALITY = 82
+
 # Placeholder image size (px)
 PLACEHOLDER_SIZE = (800, 600)
 
 # Timeout for image requests
 REQUEST_TIMEOUT = 8
 
-# Rejestracja czcionki TrueType obsługującej polskie znaki
+# Maximum number of concurrent image downloads
+PREFETCH_CONCURRENCY = 20
+
+# Links that already failed to download or decode -> placeholder without retrying
+_FAILED_LINKS = set()
+# Resized and encoded images (bytes, size in points) keyed by (link, max_width, max_height)
+_ENCODED_CACHE = {}
+
+# PDF streams are binary: no ASCII85 wrapper around deflated pages and
+# JPEG images (those keep only DCTDecode), which saves a pass over every stream
+rl_config.useA85 = 0
+
+# Katalog z miniaturami pobranych obrazów, używany przy kolejnych uruchomieniach
+THUMBNAIL_CACHE_DIR = '.fiszki_cache'
+
+# Czcionka TrueType obsługująca polskie znaki, rejestrowana przez register_fonts()
 FONT_PATH = 'DejaVuSans.ttf'  # Upewnij się, że plik jest w katalogu projektu
-try:
-    pdfmetrics.registerFont(TTFont('DejaVuSans', FONT_PATH))
-    pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', FONT_PATH))
-    FONT_NAME = 'DejaVuSans'
-    FONT_BOLD_NAME = 'DejaVuSans-Bold'
-except Exception:
-    # Fallback do Helvetica jeśli nie znaleziono czcionki
-    FONT_NAME = 'Helvetica'
-    FONT_BOLD_NAME = 'Helvetica-Bold'
+# Fallback do Helvetica jeśli nie znaleziono czcionki
+FONT_NAME = 'Helvetica'
+FONT_BOLD_NAME = 'Helvetica-Bold'
+
+# Minimum decoded size (pixels, all images together) worth starting worker processes for
+PROCESS_POOL_MIN_PIXELS = 50_000_000
+
+
+@functools.lru_cache(maxsize=None)
+def register_fonts():
+    """Register the TrueType font once.
+
+    Not done at import: image worker processes re-import this file (spawn on
+    Windows/macOS) and never draw text.
+    """
+    global FONT_NAME, FONT_BOLD_NAME
+    try:
+        pdfmetrics.registerFont(TTFont('DejaVuSans', FONT_PATH))
+        pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', FONT_PATH))
+        FONT_NAME = 'DejaVuSans'
+        FONT_BOLD_NAME = 'DejaVuSans-Bold'
+    except Exception:
+        pass
+
+
+def text_fonts():
+    """Font (name, size) for each text field of the card"""
+    return {
+        'TEKST': (FONT_BOLD_NAME, WORD_FONT_SIZE),
+        'ZDANIE_EN': (FONT_NAME, SENTENCE_FONT_SIZE),
+        'TŁUMACZENIE': (FONT_NAME, TRANSL_FONT_SIZE),
+        'ZDANIE_ES': (FONT_NAME, SENTENCE_FONT_SIZE),
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _placeholder_font():
+    # loaded once, on the first placeholder
+    try:
+        return ImageFont.truetype(FONT_PATH, 36)
+    except Exception:
+        return ImageFont.load_default()
+
+
+# Accepted variants of column names
+COLUMN_ALIASES = {
+    'TEKST': ('TEKST', 'Tekst', 'tekst', 'WORD', 'word'),
+    'TŁUMACZENIE': ('TŁUMACZENIE', 'Tlumaczenie', 'TŁUM', 'TLUMACZENIE', 'translation'),
+    'LINK DO OBRAZKA': ('LINK DO OBRAZKA', 'LINK_DO_OBRAZKA', 'LINK', 'IMAGE', 'LINK_DO_OBRAZU'),
+    'ZDANIE_EN': ('ZDANIE_EN', 'ZDANIE en', 'EN_SENTENCE'),
+    'ZDANIE_ES': ('ZDANIE_ES', 'ZDANIE es', 'ES_SENTENCE'),
+}
+
+
+def _first_value(r, indices):
+    for i in indices:
+        if i < len(r) and r[i]:
+            return r[i]
+    return None
 
 
 def read_csv(path):
     rows = []
     with open(path, newline='', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        # normalize keys
-        for i, r in enumerate(reader, start=1):
-            # Accept variants of column names
-            tekst = r.get('TEKST') or r.get('Tekst') or r.get('tekst') or r.get('WORD') or r.get('WORD'.lower())
-            tlum = r.get('TŁUMACZENIE') or r.get('Tlumaczenie') or r.get('TŁUM') or r.get('TLUMACZENIE') or r.get('translation')
-            link = r.get('LINK DO OBRAZKA') or r.get('LINK_DO_OBRAZKA') or r.get('LINK') or r.get('IMAGE') or r.get('LINK_DO_OBRAZU')
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        # resolve column indices for all name variants once
+        idx = {name: i for i, name in enumerate(header)}
+        cols = {key: [idx[a] for a in aliases if a in idx] for key, aliases in COLUMN_ALIASES.items()}
+        idx_tekst = cols['TEKST']
+        idx_tlum = cols['TŁUMACZENIE']
+        idx_link = cols['LINK DO OBRAZKA']
+        idx_en = cols['ZDANIE_EN']
+        idx_es = cols['ZDANIE_ES']
+        # blank lines are skipped like in csv.DictReader
+        for i, r in enumerate((r for r in reader if r), start=1):
+            tekst = _first_value(r, idx_tekst)
+            tlum = _first_value(r, idx_tlum)
+            link = _first_value(r, idx_link)
             if tekst is None and tlum is None and link is None:
                 # skip empty rows
                 continue
-            zdanie_en = r.get('ZDANIE_EN') or r.get('ZDANIE en') or r.get('EN_SENTENCE') or ''
-            zdanie_es = r.get('ZDANIE_ES') or r.get('ZDANIE es') or r.get('ES_SENTENCE') or ''
+            zdanie_en = _first_value(r, idx_en) or ''
+            zdanie_es = _first_value(r, idx_es) or ''
             rows.append({
                 'TEKST': (tekst or '').strip(),
                 'TŁUMACZENIE': (tlum or '').strip(),
@@ -96,147 +186,527 @@ def read_csv(path):
     return rows
 
 
-def fetch_image(link):
-    """Return PIL.Image or raise exception"""
+def normalize_link(link):
+    """Strip the link; for URLs also lower-case scheme and host (the path is case-sensitive)"""
+    link = (link or '').strip()
+    if not is_remote_link(link):
+        return link
+    try:
+        parts = urlsplit(link)
+    except ValueError:
+        return link
+    userinfo, at, host = parts.netloc.rpartition('@')
+    return urlunsplit(parts._replace(scheme=parts.scheme.lower(), netloc=userinfo + at + host.lower()))
+
+
+def is_remote_link(link):
+    # only the scheme prefix is inspected, without touching the filesystem
+    return link[:8].lower().startswith(('http://', 'https://'))
+
+
+async def _fetch_bytes(session, semaphore, link):
+    async with semaphore:
+        async with session.get(link) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+
+async def prefetch_images(rows):
+    """Download all remote images concurrently and store raw bytes in row['image_bytes']"""
+    # group rows by link so every unique URL is downloaded only once
+    rows_by_link = {}
+    img_max_w, img_max_h = image_box(*card_size())
+    for r in rows:
+        link = normalize_link(r.get('LINK DO OBRAZKA'))
+        if not is_remote_link(link):
+            continue
+        # thumbnails saved by a previous run need no download
+        if link not in rows_by_link and cached_thumbnail(link, img_max_w, img_max_h):
+            continue
+        rows_by_link.setdefault(link, []).append(r)
+    if not rows_by_link:
+        return
+    links = list(rows_by_link)
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    # imported here, so image worker processes do not pay for it
+    import aiohttp
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        results = await asyncio.gather(
+            *[_fetch_bytes(session, semaphore, link) for link in links],
+            return_exceptions=True,
+        )
+    for link, result in zip(links, results):
+        # failed downloads are left without image_bytes -> placeholder
+        if isinstance(result, BaseException):
+            _FAILED_LINKS.add(link)
+            continue
+        for row in rows_by_link[link]:
+            row['image_bytes'] = result
+
+
+@functools.lru_cache(maxsize=None)
+def _get_session():
+    # Shared HTTP session created on first use: keep-alive connections are
+    # reused for links on the same host
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                          max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def local_image_path(link):
+    """Return file path for a local (non-URL) link; the file may not exist"""
+    if link.startswith('file://'):
+        return link[7:]
+    return link
+
+
+def draft_jpeg(img, max_width, max_height):
+    """Let libjpeg decode img at a reduced DCT scale (1/2 .. 1/8) for the box.
+
+    Still not below the target pixel size in any orientation. Only works
+    before the image is loaded, later (or without a box) it is a no-op.
+    """
+    if img.format == 'JPEG' and max_width and max_height:
+        px = int(max(max_width, max_height) / 72 * IMAGE_DPI)
+        img.draft(img.mode, (px, px))
+    return img
+
+
+def fetch_image(link, max_width=None, max_height=None):
+    """Return PIL.Image or raise exception, JPEGs are decoded just big enough for the box"""
     if not link:
         raise ValueError('Empty link')
-    # If it's a local file path
-    if link.startswith('file://'):
-        path = link[7:]
-        return Image.open(path)
-    if os.path.exists(link):
-        return Image.open(link)
+    # Cheapest checks first: URL prefixes, the filesystem is only hit by Image.open.
+    # Remote images are normally downloaded up front by prefetch_images,
+    # this is the synchronous fallback when they were not prefetched
+    if is_remote_link(link):
+        # let PIL read straight from the response stream, without a resp.content copy
+        with _get_session().get(link, timeout=REQUEST_TIMEOUT, stream=True) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            img = draft_jpeg(Image.open(resp.raw), max_width, max_height)
+            img.load()
+        return img
+
+    # Local file path (file:// or plain path), raises if it does not exist
+    return Image.open(local_image_path(link))
+
+
+def normalize_orientation(img):
+    """Respect EXIF orientation, skipping the transpose copy for upright images"""
+    if img.getexif().get(0x0112, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+    return img
 
-    # Otherwise try HTTP(S)
-    if link.lower().startswith('http'):
-        resp = requests.get(link, timeout=REQUEST_TIMEOUT)
-        resp.raise_for_status()
-        return Image.open(io.BytesIO(resp.content))
 
-    # Unknown format -> try open as path anyway (may raise)
-    return Image.open(link)
+def get_image(link, image_bytes=None, max_width=None, max_height=None):
+    """Return decoded PIL.Image for link, links that failed before raise at once.
 
+    With a box (max_width, max_height) JPEGs are decoded only as big as it needs.
+    """
+    key = normalize_link(link)
+    if key in _FAILED_LINKS:
+        raise ValueError('Image already failed: %s' % key)
+    try:
+        if image_bytes is not None:
+            img = Image.open(io.BytesIO(image_bytes))
+        else:
+            img = fetch_image(key, max_width, max_height)
+        # before normalize_orientation, which loads the image
+        img = normalize_orientation(draft_jpeg(img, max_width, max_height))
+        img.load()
+    except Exception:
+        _FAILED_LINKS.add(key)
+        raise
+    return img
 
-def make_placeholder(text):
-    """Create a simple placeholder image with the TEKST centered"""
+
+@functools.lru_cache(maxsize=512)
+def _make_placeholder_cached(text):
+    # PNG bytes rather than the mutable PIL.Image, so cached entries are never modified
     img = Image.new('RGB', PLACEHOLDER_SIZE, (240, 240, 240))
     try:
-        from PIL import ImageDraw, ImageFont
         draw = ImageDraw.Draw(img)
-        # try to use a truetype font, fallback to default
-        try:
-            font = ImageFont.truetype('DejaVuSans.ttf', 36)
-        except Exception:
-            font = ImageFont.load_default()
-        w, h = draw.textsize(text, font=font)
-        draw.text(((PLACEHOLDER_SIZE[0]-w)/2, (PLACEHOLDER_SIZE[1]-h)/2), text, fill=(80,80,80), font=font)
+        font = _placeholder_font()
+        # metrics-only call, draw.textsize was removed in Pillow 10
+        left, top, right, bottom = font.getbbox(text)
+        w, h = right - left, bottom - top
+        draw.text(((PLACEHOLDER_SIZE[0]-w)/2 - left, (PLACEHOLDER_SIZE[1]-h)/2 - top), text, fill=(80,80,80), font=font)
     except Exception:
         pass
-    return img
+    bio = io.BytesIO()
+    img.save(bio, format='PNG')
+    return bio.getvalue()
 
 
-def pil_image_to_reportlab(img, max_width, max_height):
-    # Resize preserving aspect ratio
-    img = ImageOps.exif_transpose(img)  # respect EXIF orientation
-    img.thumbnail((int(max_width), int(max_height)), Image.LANCZOS)
+def make_placeholder(text):
+    """Create a simple placeholder image with the TEKST centered"""
+    return Image.open(io.BytesIO(_make_placeholder_cached(text)))
+
+
+def has_transparency(img):
+    """True if the image actually uses an alpha channel or a transparent colour"""
+    if 'transparency' in img.info:
+        return True
+    if 'A' in img.getbands():
+        return img.getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def fit_size(px_size, max_width, max_height):
+    """Size on the card in points: fit into the box, small images are not upscaled"""
+    w, h = px_size
+    scale = min(max_width / w, max_height / h, 1)
+    return w * scale, h * scale
+
+
+def encode_image(img, max_width, max_height):
+    """Resize image for the card and encode it, return (bytes, size in points)"""
+    draft_jpeg(img, max_width, max_height)
+    # no-op for images normalized by get_image
+    img = normalize_orientation(img)
+    size = fit_size(img.size, max_width, max_height)
+    # Resize preserving aspect ratio to the pixel size needed at IMAGE_DPI;
+    # resize() returns a new image, the input image is left unchanged
+    px_w = max(1, round(size[0] / 72 * IMAGE_DPI))
+    px_h = max(1, round(size[1] / 72 * IMAGE_DPI))
+    ratio = min(px_w / img.width, px_h / img.height)
+    if ratio < 1:
+        new_size = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+        img = img.resize(new_size, Image.LANCZOS, reducing_gap=2.0)
+        # same size as cached_thumbnail derives from the pixel size on later runs
+        size = fit_size(img.size, max_width, max_height)
     bio = io.BytesIO()
-    img.save(bio, format='PNG')
-    bio.seek(0)
-    return ImageReader(bio), img.size
+    if has_transparency(img):
+        # keep transparency for mask='auto'
+        img.save(bio, format='PNG')
+    else:
+        # JPEG is embedded as-is with DCTDecode, without ReportLab's own deflate pass
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('L' if img.mode == 'LA' else 'RGB')
+        img.save(bio, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=False)
+    return bio.getvalue(), size
 
 
-def draw_card(c, x, y, w, h, item):
-    # Draw border (gray)
-    from reportlab.lib.colors import gray
-    c.setStrokeColor(gray)
-    c.rect(x, y, w, h)
-    c.setStrokeColorRGB(0, 0, 0)  # reset to black for other elements if needed
+def _decode_resize_encode(args):
+    # Runs in a worker process: only bytes cross the process boundary
+    data, max_width, max_height = args
+    return encode_image(Image.open(io.BytesIO(data)), max_width, max_height)
 
-    # Padding inside card
-    pad = 6 * mm
-    inner_x = x + pad
-    inner_y = y + pad
-    inner_w = w - 2 * pad
-    inner_h = h - 2 * pad
 
-    word = item.get('TEKST', '')
-    transl = item.get('TŁUMACZENIE', '')
-    zdanie_en = item.get('ZDANIE_EN', '')
-    zdanie_es = item.get('ZDANIE_ES', '')
+def pil_image_to_reportlab(img, max_width, max_height):
+    data, size = encode_image(img, max_width, max_height)
+    return ImageReader(io.BytesIO(data)), size
+
+
+def thumbnail_cache_path(link, max_width, max_height):
+    """Path (without extension) of the on-disk thumbnail for link and size"""
+    digest = hashlib.sha1(link.encode('utf-8')).hexdigest()
+    return os.path.join(THUMBNAIL_CACHE_DIR, '%s_%dx%d_%d' % (digest, max_width, max_height, IMAGE_DPI))
+
+
+def cached_thumbnail(link, max_width, max_height):
+    """Return (bytes, size) already encoded in this or a previous run, or None"""
+    key = (link, int(max_width), int(max_height))
+    cached = _ENCODED_CACHE.get(key)
+    if cached is not None or not is_remote_link(link):
+        # local files may change between runs, they are not cached on disk
+        return cached
+    path = thumbnail_cache_path(link, max_width, max_height)
+    for ext in ('.jpg', '.png'):
+        if os.path.exists(path + ext):
+            try:
+                with open(path + ext, 'rb') as f:
+                    data = f.read()
+                # only the header is parsed, the thumbnail is not decoded
+                px_size = Image.open(io.BytesIO(data)).size
+            except OSError:
+                # broken cache file: remove it and fetch the link again
+                try:
+                    os.remove(path + ext)
+                except OSError:
+                    pass
+                return None
+            cached = data, fit_size(px_size, max_width, max_height)
+            _ENCODED_CACHE[key] = cached
+            return cached
+    return None
+
+
+def store_thumbnail(link, max_width, max_height, encoded):
+    _ENCODED_CACHE[(link, int(max_width), int(max_height))] = encoded
+    if not is_remote_link(link):
+        return
+    data = encoded[0]
+    ext = '.jpg' if data[:2] == b'\xff\xd8' else '.png'
+    try:
+        os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+        # write a temporary file and rename it, so an interrupted run
+        # never leaves a partial thumbnail under the final name
+        fd, tmp_path = tempfile.mkstemp(dir=THUMBNAIL_CACHE_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, thumbnail_cache_path(link, max_width, max_height) + ext)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    except OSError:
+        # the cache is only an optimization
+        pass
 
-    # TEKST na górze
-    c.setFont(FONT_BOLD_NAME, WORD_FONT_SIZE)
-    word_y = inner_y + inner_h - WORD_FONT_SIZE - 2  # górna część karty
-    c.drawCentredString(x + w / 2, word_y, word)
 
-    # Angielskie zdanie pod TEKST
-    sentence_font_size = 10
-    c.setFont(FONT_NAME, sentence_font_size)
-    sentence_y_en = word_y - sentence_font_size - 10
-    if zdanie_en:
-        c.drawCentredString(x + w / 2, sentence_y_en, zdanie_en)
+def get_image_reader(link, image_bytes, max_width, max_height):
+    """Return (ImageReader, size) for link, resizing and encoding each link once per size"""
+    cached = cached_thumbnail(link, max_width, max_height)
+    if cached is None:
+        cached = encode_image(get_image(link, image_bytes, max_width, max_height),
+                              max_width, max_height)
+        store_thumbnail(link, max_width, max_height, cached)
+    data, size = cached
+    return ImageReader(io.BytesIO(data)), size
+
+
+def _total_pixels(datas):
+    # only image headers are parsed
+    total = 0
+    for data in datas:
+        try:
+            w, h = Image.open(io.BytesIO(data)).size
+        except Exception:
+            continue
+        total += w * h
+    return total
+
+
+def prepare_images(rows, max_width, max_height):
+    """Decode, resize and encode all unique images in parallel worker processes"""
+    jobs = {}
+    rows_by_link = {}
+    for r in rows:
+        link = normalize_link(r.get('LINK DO OBRAZKA'))
+        rows_by_link.setdefault(link, []).append(r)
+        if not link or link in jobs or link in _FAILED_LINKS:
+            continue
+        if cached_thumbnail(link, max_width, max_height):
+            continue
+        data = r.get('image_bytes')
+        if data is None:
+            if is_remote_link(link):
+                # not prefetched, fetched by draw_card_image instead
+                continue
+            try:
+                with open(local_image_path(link), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                # missing or unreadable file -> placeholder without opening it again
+                _FAILED_LINKS.add(link)
+                continue
+        jobs[link] = data
+    if len(jobs) < 2 or _total_pixels(jobs.values()) < PROCESS_POOL_MIN_PIXELS:
+        # not worth starting worker processes, draw_card_image encodes inline
+        return
+    links = list(jobs)
+    with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as ex:
+        futures = [ex.submit(_decode_resize_encode, (jobs[link], max_width, max_height)) for link in links]
+        for link, future in zip(links, futures):
+            try:
+                encoded = future.result()
+            except BrokenProcessPool:
+                # a worker died, not the image's fault: draw_card_image encodes it inline
+                continue
+            except Exception:
+                _FAILED_LINKS.add(link)
+                continue
+            store_thumbnail(link, max_width, max_height, encoded)
+            # downloaded bytes are not needed once the thumbnail is encoded
+            for r in rows_by_link[link]:
+                r.pop('image_bytes', None)
+
+
+def image_xobject_name(key, max_width, max_height):
+    """Stable PDF XObject name for an image key drawn in the given box"""
+    return hashlib.sha1(('%s|%dx%d' % (key, max_width, max_height)).encode('utf-8')).hexdigest()
+
+
+def draw_named_image(c, name, img_reader, x, y, w, h):
+    """Draw image through a named form XObject, so the bitmap is embedded in the PDF once per name.
+
+    img_reader is only used when the form does not exist yet and may be None otherwise.
+    """
+    if not c.hasForm(name):
+        c.beginForm(name, 0, 0, 1, 1)
+        c.drawImage(img_reader, 0, 0, width=1, height=1, mask='auto')
+        c.endForm()
+    c.saveState()
+    c.translate(x, y)
+    c.scale(w, h)
+    c.doForm(name)
+    c.restoreState()
+
+
+def measure_text_widths(rows):
+    """Precompute widths of the card texts, so draw_card does not measure strings"""
+    for row in rows:
+        row['text_widths'] = {field: pdfmetrics.stringWidth(row.get(field, ''), font, size)
+                              for field, (font, size) in text_fonts().items()}
+
+
+def card_size():
+    """Return (width, height) of a card in points"""
+    page_w, page_h = PAGE_SIZE
+    card_w = (page_w - 2 * MARGIN - (COLUMNS - 1) * GAP) / COLUMNS
+    card_h = (page_h - 2 * MARGIN - (ROWS - 1) * GAP) / ROWS
+    return card_w, card_h
+
+
+def image_box(w, h):
+    """Return maximum image (width, height) in points on a card of the given size"""
+    inner_w = w - 2 * CARD_PADDING
+    inner_h = h - 2 * CARD_PADDING
+    return inner_w * IMAGE_MAX_WIDTH_RATIO, inner_h * IMAGE_HEIGHT_RATIO - 4
+
+
+def draw_card_image(c, x, y, w, h, item):
+    """Draw card image (or placeholder) in the middle of the card"""
+    inner_x = x + CARD_PADDING
+    inner_y = y + CARD_PADDING
+    inner_w = w - 2 * CARD_PADDING
+    inner_h = h - 2 * CARD_PADDING
+    word = item.get('TEKST', '')
 
     # Oblicz miejsce na obrazek
     img_area_h = inner_h * IMAGE_HEIGHT_RATIO
-    img_max_w = inner_w * IMAGE_MAX_WIDTH_RATIO
-    img_max_h = img_area_h - 4
+    img_max_w, img_max_h = image_box(w, h)
 
     img_reader = None
     img_size = (0, 0)
+    link = normalize_link(item.get('LINK DO OBRAZKA'))
     try:
-        pil_img = fetch_image(item.get('LINK DO OBRAZKA'))
-    except Exception:
-        pil_img = make_placeholder(word)
-
-    try:
-        img_reader, img_size = pil_image_to_reportlab(pil_img, img_max_w, img_max_h)
+        img_name = image_xobject_name(link, img_max_w, img_max_h)
+        cached = cached_thumbnail(link, img_max_w, img_max_h) if c.hasForm(img_name) else None
+        if cached is not None:
+            # image already in the PDF, only its size is needed
+            img_size = cached[1]
+        else:
+            img_reader, img_size = get_image_reader(link, item.get('image_bytes'), img_max_w, img_max_h)
     except Exception:
-        pil_img = make_placeholder(word)
-        img_reader, img_size = pil_image_to_reportlab(pil_img, img_max_w, img_max_h)
+        img_name = image_xobject_name('ph:' + word, img_max_w, img_max_h)
+        img_size = fit_size(PLACEHOLDER_SIZE, img_max_w, img_max_h)
+        # placeholder bitmap is only needed when its form is not in the PDF yet
+        if not c.hasForm(img_name):
+            pil_img = make_placeholder(word)
+            img_reader, img_size = pil_image_to_reportlab(pil_img, img_max_w, img_max_h)
 
     # Pozycja obrazka: środek karty
     iw, ih = img_size
     img_x = inner_x + (inner_w - iw) / 2
     img_y = inner_y + (inner_h - img_area_h) / 2 + (img_area_h - ih) / 2
-    c.drawImage(img_reader, img_x, img_y, width=iw, height=ih, preserveAspectRatio=True, mask='auto')
+    draw_named_image(c, img_name, img_reader, img_x, img_y, iw, ih)
+
+
+def _draw_centred_field(t, center_x, y, item, field):
+    text = item.get(field, '')
+    if text:
+        t.setTextOrigin(center_x - item['text_widths'][field] / 2, y)
+        t.textOut(text)
+
+
+def draw_page(c, cards, w, h):
+    """Draw cards [((x, y), item), ...] of one page.
+
+    Every element is drawn in a separate pass over the cards, each text pass
+    as a single text object, so fonts and stroke colour are set a few times
+    per page instead of for every card.
+    """
+    inner_h = h - 2 * CARD_PADDING
+    word_dy = CARD_PADDING + inner_h - WORD_FONT_SIZE - 2  # górna część karty
+    sentence_en_dy = word_dy - SENTENCE_FONT_SIZE - 10
+    transl_dy = CARD_PADDING + TRANSL_FONT_SIZE + 2  # dolna część karty
+    sentence_es_dy = transl_dy + SENTENCE_FONT_SIZE + 10
+
+    # Draw borders (gray)
+    c.setStrokeColor(gray)
+    for (x, y), item in cards:
+        c.rect(x, y, w, h)
+    c.setStrokeColorRGB(0, 0, 0)  # reset to black for other elements if needed
+
+    # TEKST na górze
+    t = c.beginText()
+    t.setFont(FONT_BOLD_NAME, WORD_FONT_SIZE)
+    for (x, y), item in cards:
+        _draw_centred_field(t, x + w / 2, y + word_dy, item, 'TEKST')
+    c.drawText(t)
+
+    # Angielskie zdanie pod TEKST, hiszpańskie zdanie nad TŁUMACZENIE
+    t = c.beginText()
+    t.setFont(FONT_NAME, SENTENCE_FONT_SIZE)
+    for (x, y), item in cards:
+        _draw_centred_field(t, x + w / 2, y + sentence_en_dy, item, 'ZDANIE_EN')
+        _draw_centred_field(t, x + w / 2, y + sentence_es_dy, item, 'ZDANIE_ES')
+    c.drawText(t)
+
+    # Obrazki
+    for (x, y), item in cards:
+        draw_card_image(c, x, y, w, h, item)
 
     # TŁUMACZENIE na dole
-    c.setFont(FONT_NAME, TRANSL_FONT_SIZE)
-    transl_y = inner_y + TRANSL_FONT_SIZE + 2  # dolna część karty
-    c.drawCentredString(x + w / 2, transl_y, transl)
+    t = c.beginText()
+    t.setFont(FONT_NAME, TRANSL_FONT_SIZE)
+    for (x, y), item in cards:
+        _draw_centred_field(t, x + w / 2, y + transl_dy, item, 'TŁUMACZENIE')
+    c.drawText(t)
+
+
+def release_images(rows, last_page, page, max_width, max_height):
+    """Free image data of a finished page, keeping links that later pages still use"""
+    for row in rows:
+        row.pop('image_bytes', None)
+        link = normalize_link(row.get('LINK DO OBRAZKA'))
+        if last_page.get(link) == page:
+            # the bitmap is already embedded in the PDF as a named XObject
+            _ENCODED_CACHE.pop((link, int(max_width), int(max_height)), None)
 
-    # Hiszpańskie zdanie pod TŁUMACZENIE
-    c.setFont(FONT_NAME, sentence_font_size)
-    sentence_y_es = transl_y + sentence_font_size + 10
-    if zdanie_es:
-        c.drawCentredString(x + w / 2, sentence_y_es, zdanie_es)
 
 def generate_pdf(data_rows, out_path):
-    page_w, page_h = PAGE_SIZE
-    c = canvas.Canvas(out_path, pagesize=PAGE_SIZE)
+    # PDF is built in memory and written to out_path with a single write
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=PAGE_SIZE, pageCompression=1)
 
-    card_w = (page_w - 2 * MARGIN - (COLUMNS - 1) * GAP) / COLUMNS
-    card_h = (page_h - 2 * MARGIN - (ROWS - 1) * GAP) / ROWS
+    card_w, card_h = card_size()
+
+    img_max_w, img_max_h = image_box(card_w, card_h)
+    prepare_images(data_rows, img_max_w, img_max_h)
+    register_fonts()
+    measure_text_widths(data_rows)
 
     total = len(data_rows)
     pages = math.ceil(total / CARDS_PER_PAGE) if total > 0 else 1
 
-    idx = 0
+    # Card positions on a page, row by row from the top (y from bottom)
+    positions = [(MARGIN + col * (card_w + GAP), MARGIN + (ROWS - 1 - r) * (card_h + GAP))
+                 for r in range(ROWS) for col in range(COLUMNS)]
+
+    # Last page on which each link is used
+    last_page = {}
+    for i, row in enumerate(data_rows):
+        last_page[normalize_link(row.get('LINK DO OBRAZKA'))] = i // CARDS_PER_PAGE
+
     for p in range(pages):
-        for r in range(ROWS):
-            for col in range(COLUMNS):
-                if idx >= total:
-                    break
-                x = MARGIN + col * (card_w + GAP)
-                # from bottom
-                y = MARGIN + (ROWS - 1 - r) * (card_h + GAP)
-                item = data_rows[idx]
-                draw_card(c, x, y, card_w, card_h, item)
-                idx += 1
-            # end cols
-        # end rows
+        page_rows = data_rows[p * CARDS_PER_PAGE:(p + 1) * CARDS_PER_PAGE]
+        draw_page(c, list(zip(positions, page_rows)), card_w, card_h)
         c.showPage()
+        release_images(page_rows, last_page, p, img_max_w, img_max_h)
     c.save()
+    with open(out_path, 'wb', buffering=1 << 20) as f:
+        f.write(buf.getbuffer())
     print(f'Zapisano {out_path} ({total} fiszek, {pages} stron)')
 
 
@@ -256,6 +726,7 @@ def main():
         print('Brak wierszy do przetworzenia')
         sys.exit(1)
 
+    asyncio.run(prefetch_images(rows))
     generate_pdf(rows, out_pdf)
 
 